@@ -0,0 +1,11 @@
+import sys
+
+# Numba is not available on PyPy, and PyPy's tracing JIT already runs the plain
+# Python loops quickly, so the Numba kernels are only used on CPython. Both
+# modules provide the same functions.
+if sys.implementation.name == "pypy":
+    from cougar_analysis._python_decode import gather_payloads, scan_records
+else:
+    from cougar_analysis._numba_decode import gather_payloads, scan_records
+
+__all__ = ["gather_payloads", "scan_records"]
@@ -0,0 +1,116 @@
+import os
+import threading
+
+import numpy as np
+from numba import config, njit, prange
+
+
+@njit(cache=True)
+def _read_varint(buf, pos, length):
+    val = np.int64(0)
+    for i in range(length):
+        val |= np.int64(buf[pos + i]) << (8 * i)
+    return val
+
+
+@njit(cache=True)
+def _walk_records(buf, pos, entry_ids, timestamps, data_offsets, data_sizes):
+    # Walks the record headers starting at pos. When the output arrays are
+    # empty the records are only counted, which is used to size them.
+    fill = entry_ids.shape[0] > 0
+    end = buf.shape[0]
+    n = 0
+    while end >= pos + 4:
+        header = buf[pos]
+        entry_len = (header & 0x3) + 1
+        size_len = ((header >> 2) & 0x3) + 1
+        timestamp_len = ((header >> 4) & 0x7) + 1
+        header_len = 1 + entry_len + size_len + timestamp_len
+        if end < pos + header_len:
+            break
+        size = _read_varint(buf, pos + 1 + entry_len, size_len)
+        if end < pos + header_len + size:
+            break
+        if fill:
+            entry_ids[n] = _read_varint(buf, pos + 1, entry_len)
+            timestamps[n] = _read_varint(
+                buf, pos + 1 + entry_len + size_len, timestamp_len
+            )
+            data_offsets[n] = pos + header_len
+            data_sizes[n] = size
+        n += 1
+        pos += header_len + size
+    return n
+
+
+@njit(cache=True)
+def scan_records(buf, pos):
+    """Parses every record header in a wpilog buffer.
+
+    buf: The log as a uint8 array.
+    pos: Offset of the first record (after the file header).
+    Returns parallel int64 arrays of entry IDs, timestamps, payload offsets and
+    payload sizes, one element per record.
+    """
+    empty = np.empty(0, dtype=np.int64)
+    n = _walk_records(buf, pos, empty, empty, empty, empty)
+
+    entry_ids = np.empty(n, dtype=np.int64)
+    timestamps = np.empty(n, dtype=np.int64)
+    data_offsets = np.empty(n, dtype=np.int64)
+    data_sizes = np.empty(n, dtype=np.int64)
+    if n > 0:
+        _walk_records(buf, pos, entry_ids, timestamps, data_offsets, data_sizes)
+
+    return entry_ids, timestamps, data_offsets, data_sizes
+
+
+# The TBB threading layer, which Numba prefers when it is installed, keeps the
+# process from exiting after parallel kernels are launched from several threads.
+# Use the built-in workqueue layer unless one was chosen explicitly; it does not
+# support concurrent launches either, so launches are serialized below.
+if "NUMBA_THREADING_LAYER" not in os.environ:
+    config.THREADING_LAYER = "workqueue"
+
+_parallel_lock = threading.Lock()
+
+
+@njit(parallel=True, cache=True)
+def _gather_payloads_parallel(buf, offsets, width):
+    out = np.empty(offsets.shape[0] * width, dtype=np.uint8)
+    # Each record writes only its own slot, so rows can be copied in any order
+    for row in prange(offsets.shape[0]):
+        start = offsets[row]
+        for i in range(width):
+            out[row * width + i] = buf[start + i]
+    return out
+
+
+@njit(cache=True)
+def _gather_payloads_serial(buf, offsets, width):
+    out = np.empty(offsets.shape[0] * width, dtype=np.uint8)
+    for row in range(offsets.shape[0]):
+        start = offsets[row]
+        for i in range(width):
+            out[row * width + i] = buf[start + i]
+    return out
+
+
+def gather_payloads(buf, offsets, width):
+    """Copies fixed-width record payloads into one contiguous array.
+
+    buf: The log as a uint8 array.
+    offsets: Payload offsets of the records to copy, as an int64 array.
+    width: Size in bytes of every payload.
+    Returns a uint8 array of len(offsets) * width bytes, ready to be viewed as
+    the payload type.
+    """
+    # The threaded kernel releases the GIL, but only pays off with more than one
+    # thread; otherwise its scheduling overhead makes it slower than the serial one.
+    # The configured count is read instead of get_num_threads(), which would start
+    # the thread pool even when it is never used.
+    if config.NUMBA_NUM_THREADS > 1:
+        # Streamlit runs each session in its own thread
+        with _parallel_lock:
+            return _gather_payloads_parallel(buf, offsets, width)
+    return _gather_payloads_serial(buf, offsets, width)
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def _read_varint(buf, pos, length):
+    val = 0
+    for i in range(length):
+        val |= buf[pos + i] << (8 * i)
+    return val
+
+
+def scan_records(buf, pos):
+    """Parses every record header in a wpilog buffer.
+
+    buf: The log as a uint8 array.
+    pos: Offset of the first record (after the file header).
+    Returns parallel int64 arrays of entry IDs, timestamps, payload offsets and
+    payload sizes, one element per record.
+    """
+    # Index a memoryview rather than the array so each byte is a plain int
+    buf = memoryview(buf)
+    end = len(buf)
+
+    entry_ids = []
+    timestamps = []
+    data_offsets = []
+    data_sizes = []
+    while end >= pos + 4:
+        header = buf[pos]
+        entry_len = (header & 0x3) + 1
+        size_len = ((header >> 2) & 0x3) + 1
+        timestamp_len = ((header >> 4) & 0x7) + 1
+        header_len = 1 + entry_len + size_len + timestamp_len
+        if end < pos + header_len:
+            break
+        size = _read_varint(buf, pos + 1 + entry_len, size_len)
+        if end < pos + header_len + size:
+            break
+        entry_ids.append(_read_varint(buf, pos + 1, entry_len))
+        timestamps.append(
+            _read_varint(buf, pos + 1 + entry_len + size_len, timestamp_len)
+        )
+        data_offsets.append(pos + header_len)
+        data_sizes.append(size)
+        pos += header_len + size
+
+    return (
+        np.array(entry_ids, dtype=np.int64),
+        np.array(timestamps, dtype=np.int64),
+        np.array(data_offsets, dtype=np.int64),
+        np.array(data_sizes, dtype=np.int64),
+    )
+
+
+def gather_payloads(buf, offsets, width):
+    """Copies fixed-width record payloads into one contiguous array.
+
+    buf: The log as a uint8 array.
+    offsets: Payload offsets of the records to copy, as an int64 array.
+    width: Size in bytes of every payload.
+    Returns a uint8 array of len(offsets) * width bytes, ready to be viewed as
+    the payload type.
+    """
+    return buf[(offsets[:, None] + np.arange(width)).ravel()]
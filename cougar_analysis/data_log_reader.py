@@ -2,20 +2,92 @@
 # DataLogReader and related classes from:
 # https://github.com/wpilibsuite/allwpilib/blob/main/wpiutil/examples/printlog/datalog.py
 
-import array
 import struct
-from typing import List, SupportsBytes
+import sys
+from typing import Iterator, List, SupportsBytes, Tuple
+
+import numpy as np
+
+from cougar_analysis._fast_decode import scan_records
 
 __all__ = ["StartRecordData", "MetadataRecordData", "DataLogRecord", "DataLogReader"]
 
 floatStruct = struct.Struct("<f")
 doubleStruct = struct.Struct("<d")
+int64Struct = struct.Struct("<q")
+
+# Precompiled little-endian unsigned unpackers; unpack_from reads at an offset
+# without slicing the buffer.
+_U8 = struct.Struct("<B").unpack_from
+_U16 = struct.Struct("<H").unpack_from
+_U32 = struct.Struct("<I").unpack_from
+_U64 = struct.Struct("<Q").unpack_from
+
+
+def _paddedUnpacker(width: int):
+    # Odd widths have no struct format. Decode the slice directly rather than
+    # through a shared scratch buffer, since Streamlit runs each session on its
+    # own thread. Returns a 1-tuple to match the struct unpackers.
+    def unpack(buf, pos: int):
+        return (int.from_bytes(buf[pos : pos + width], "little"),)
+
+    return unpack
+
+
+# Varint unpackers indexed by field width in bytes (1-8)
+_VARINT = [
+    None,
+    _U8,
+    _U16,
+    _paddedUnpacker(3),
+    _U32,
+    _paddedUnpacker(5),
+    _paddedUnpacker(6),
+    _paddedUnpacker(7),
+    _U64,
+]
+
+# Field widths for every possible header byte, as
+# (entryLen, sizeLen, timestampLen, headerLen)
+_HDR = [
+    (
+        (b & 0x3) + 1,
+        ((b >> 2) & 0x3) + 1,
+        ((b >> 4) & 0x7) + 1,
+        1 + ((b & 0x3) + 1) + (((b >> 2) & 0x3) + 1) + (((b >> 4) & 0x7) + 1),
+    )
+    for b in range(256)
+]
 
 kControlStart = 0
 kControlFinish = 1
 kControlSetMetadata = 2
 
 
+def decodeStringArray(data) -> List[str]:
+    """Decodes a string[] payload, raising TypeError if it is malformed."""
+    length = len(data)
+    if length < 4:
+        raise TypeError("not a string array")
+    size = _U32(data, 0)[0]
+    if size > ((length - 4) / 4):
+        raise TypeError("not a string array")
+    # Find the bounds of every string first, then decode them all from a
+    # single bytes copy of the payload
+    bounds = []
+    pos = 4
+    for i in range(size):
+        if pos + 4 > length:
+            raise TypeError("invalid string size")
+        end = pos + 4 + _U32(data, pos)[0]
+        if end > length:
+            raise TypeError("invalid string size")
+        bounds.append((pos + 4, end))
+        pos = end
+    raw = bytes(data)
+    return [raw[start:end].decode("utf-8") for start, end in bounds]
+
+
 class StartRecordData:
     """Data contained in a start control record as created by DataLog.start() when
     writing the log. This can be read by calling DataLogRecord.getStartData().
@@ -23,6 +95,8 @@ class StartRecordData:
     name: Entry name.
     type: Type of the stored data for this entry, as a string, e.g. "double".
     metadata: Initial metadata.
+    decoder: Function that decodes a data record payload for this entry. Not set
+        by the reader; callers may assign one when the entry is started.
     """
 
     def __init__(self, entry: int, name: str, type: str, metadata: str):
@@ -30,6 +104,7 @@ class StartRecordData:
         self.name = name
         self.type = type
         self.metadata = metadata
+        self.decoder = None
 
 
 class MetadataRecordData:
@@ -47,44 +122,33 @@ class MetadataRecordData:
 
 class DataLogRecord:
     """A record in the data log. May represent either a control record
-    (entry == 0) or a data record."""
+    (entry == 0) or a data record.
+    controlType: The control record type (e.g. kControlStart), or -1 for data
+        records and empty control records.
+    """
 
     def __init__(self, entry: int, timestamp: int, data: SupportsBytes):
         self.entry = entry
         self.timestamp = timestamp
-        self.data = data
+        self.data = memoryview(data)
+        self.controlType = self.data[0] if entry == 0 and len(self.data) >= 1 else -1
 
     def isControl(self) -> bool:
         return self.entry == 0
 
-    def _getControlType(self) -> int:
-        return self.data[0]
-
     def isStart(self) -> bool:
-        return (
-            self.entry == 0
-            and len(self.data) >= 17
-            and self._getControlType() == kControlStart
-        )
+        return self.controlType == kControlStart and len(self.data) >= 17
 
     def isFinish(self) -> bool:
-        return (
-            self.entry == 0
-            and len(self.data) == 5
-            and self._getControlType() == kControlFinish
-        )
+        return self.controlType == kControlFinish and len(self.data) == 5
 
     def isSetMetadata(self) -> bool:
-        return (
-            self.entry == 0
-            and len(self.data) >= 9
-            and self._getControlType() == kControlSetMetadata
-        )
+        return self.controlType == kControlSetMetadata and len(self.data) >= 9
 
     def getStartData(self) -> StartRecordData:
         if not self.isStart():
             raise TypeError("not a start record")
-        entry = int.from_bytes(self.data[1:5], byteorder="little", signed=False)
+        entry = _U32(self.data, 1)[0]
         name, pos = self._readInnerString(5)
         type, pos = self._readInnerString(pos)
         metadata = self._readInnerString(pos)[0]
@@ -93,12 +157,12 @@ class DataLogRecord:
     def getFinishEntry(self) -> int:
         if not self.isFinish():
             raise TypeError("not a finish record")
-        return int.from_bytes(self.data[1:5], byteorder="little", signed=False)
+        return _U32(self.data, 1)[0]
 
     def getSetMetadataData(self) -> MetadataRecordData:
         if not self.isSetMetadata():
             raise TypeError("not a finish record")
-        entry = int.from_bytes(self.data[1:5], byteorder="little", signed=False)
+        entry = _U32(self.data, 1)[0]
         metadata = self._readInnerString(5)[0]
         return MetadataRecordData(entry, metadata)
 
@@ -110,7 +174,7 @@ class DataLogRecord:
     def getInteger(self) -> int:
         if len(self.data) != 8:
             raise TypeError("not an integer")
-        return int.from_bytes(self.data, byteorder="little", signed=True)
+        return int64Struct.unpack(self.data)[0]
 
     def getFloat(self) -> float:
         if len(self.data) != 4:
@@ -125,45 +189,31 @@ class DataLogRecord:
     def getString(self) -> str:
         return str(self.data, encoding="utf-8")
 
-    def getBooleanArray(self) -> List[bool]:
-        return [x != 0 for x in self.data]
+    def getBooleanArray(self) -> np.ndarray:
+        return np.frombuffer(self.data, dtype=np.uint8) != 0
 
-    def getIntegerArray(self) -> array.array:
+    def getIntegerArray(self) -> np.ndarray:
         if (len(self.data) % 8) != 0:
             raise TypeError("not an integer array")
-        arr = array.array("l")
-        arr.frombytes(self.data)
-        return arr
+        return np.frombuffer(self.data, dtype="<i8")
 
-    def getFloatArray(self) -> array.array:
+    def getFloatArray(self) -> np.ndarray:
         if (len(self.data) % 4) != 0:
             raise TypeError("not a float array")
-        arr = array.array("f")
-        arr.frombytes(self.data)
-        return arr
+        return np.frombuffer(self.data, dtype="<f4")
 
-    def getDoubleArray(self) -> array.array:
+    def getDoubleArray(self) -> np.ndarray:
         if (len(self.data) % 8) != 0:
             raise TypeError("not a double array")
-        arr = array.array("d")
-        arr.frombytes(self.data)
-        return arr
+        return np.frombuffer(self.data, dtype="<f8")
 
     def getStringArray(self) -> List[str]:
-        size = int.from_bytes(self.data[0:4], byteorder="little", signed=False)
-        if size > ((len(self.data) - 4) / 4):
-            raise TypeError("not a string array")
-        arr = []
-        pos = 4
-        for i in range(size):
-            val, pos = self._readInnerString(pos)
-            arr.append(val)
-        return arr
+        return decodeStringArray(self.data)
 
     def _readInnerString(self, pos: int) -> str:
-        size = int.from_bytes(
-            self.data[pos : pos + 4], byteorder="little", signed=False
-        )
+        if pos + 4 > len(self.data):
+            raise TypeError("invalid string size")
+        size = _U32(self.data, pos)[0]
         end = pos + 4 + size
         if end > len(self.data):
             raise TypeError("invalid string size")
@@ -175,24 +225,29 @@ class DataLogIterator:
 
     def __init__(self, buf: SupportsBytes, pos: int):
         self.buf = buf
+        self.mv = memoryview(buf)
         self.pos = pos
 
     def __iter__(self):
         return self
 
-    def _readVarInt(self, pos: int, len: int) -> int:
-        val = 0
-        for i in range(len):
-            val |= self.buf[pos + i] << (i * 8)
-        return val
+    if sys.implementation.name == "pypy":
+        # PyPy's JIT specializes this byte loop better than calls into struct
+        def _readVarInt(self, pos: int, len: int) -> int:
+            val = 0
+            for i in range(len):
+                val |= self.buf[pos + i] << (i * 8)
+            return val
+
+    else:
+
+        def _readVarInt(self, pos: int, len: int) -> int:
+            return _VARINT[len](self.buf, pos)[0]
 
     def __next__(self) -> DataLogRecord:
         if len(self.buf) < (self.pos + 4):
             raise StopIteration
-        entryLen = (self.buf[self.pos] & 0x3) + 1
-        sizeLen = ((self.buf[self.pos] >> 2) & 0x3) + 1
-        timestampLen = ((self.buf[self.pos] >> 4) & 0x7) + 1
-        headerLen = 1 + entryLen + sizeLen + timestampLen
+        entryLen, sizeLen, timestampLen, headerLen = _HDR[self.buf[self.pos]]
         if len(self.buf) < (self.pos + headerLen):
             raise StopIteration
         entry = self._readVarInt(self.pos + 1, entryLen)
@@ -203,7 +258,7 @@ class DataLogIterator:
         record = DataLogRecord(
             entry,
             timestamp,
-            self.buf[self.pos + headerLen : self.pos + headerLen + size],
+            self.mv[self.pos + headerLen : self.pos + headerLen + size],
         )
         self.pos += headerLen + size
         return record
@@ -214,6 +269,7 @@ class DataLogReader:
 
     def __init__(self, buf: SupportsBytes):
         self.buf = buf
+        self._table = None
 
     def __bool__(self):
         return self.isValid()
@@ -232,7 +288,7 @@ class DataLogReader:
             minor (so version 1.0 will be 0x0100)"""
         if len(self.buf) < 12:
             return 0
-        return int.from_bytes(self.buf[6:8], byteorder="little", signed=False)
+        return _U16(self.buf, 6)[0]
 
     def getExtraHeader(self) -> str:
         """Gets the extra header data.
@@ -240,11 +296,40 @@ class DataLogReader:
         """
         if len(self.buf) < 12:
             return ""
-        size = int.from_bytes(self.buf[8:12], byteorder="little", signed=False)
+        size = _U32(self.buf, 8)[0]
         return str(self.buf[12 : 12 + size], encoding="utf-8")
 
+    def _getRecordsStart(self) -> int:
+        if len(self.buf) < 12:
+            return len(self.buf)
+        extraHeaderSize = _U32(self.buf, 8)[0]
+        return 12 + extraHeaderSize
+
+    def decodeTable(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Parses the headers of every record in the log at once. Records are not
+        materialized; use the offsets and sizes to slice payloads out of the buffer.
+        @return Parallel int64 arrays of entry IDs, timestamps, payload offsets and
+            payload sizes, one element per record in log order
+        """
+        if self._table is None:
+            self._table = scan_records(
+                np.frombuffer(self.buf, dtype=np.uint8), self._getRecordsStart()
+            )
+        return self._table
+
+    def iterControl(self) -> Iterator[Tuple[int, DataLogRecord]]:
+        """Iterates over only the control records in the log. Data records are
+        skipped using the record table without being materialized.
+        @return (row, record) pairs, where row is the record's index in the
+            arrays returned by decodeTable()
+        """
+        entries, timestamps, offsets, sizes = self.decodeTable()
+        mv = memoryview(self.buf)
+        for row in np.flatnonzero(entries == 0).tolist():
+            offset = int(offsets[row])
+            yield row, DataLogRecord(
+                0, int(timestamps[row]), mv[offset : offset + int(sizes[row])]
+            )
+
     def __iter__(self) -> DataLogIterator:
-        extraHeaderSize = int.from_bytes(
-            self.buf[8:12], byteorder="little", signed=False
-        )
-        return DataLogIterator(self.buf, 12 + extraHeaderSize)
+        return DataLogIterator(self.buf, self._getRecordsStart())
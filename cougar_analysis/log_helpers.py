@@ -1,126 +1,387 @@
+import hashlib
 from datetime import datetime
 from numpy import average
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from cougar_analysis.data_log_reader import DataLogReader
+from cougar_analysis._fast_decode import gather_payloads
+from cougar_analysis.data_log_reader import (
+    DataLogReader,
+    decodeStringArray,
+    doubleStruct,
+    int64Struct,
+    kControlFinish,
+    kControlSetMetadata,
+    kControlStart,
+)
 
-HEADER_LIST = ["Timestamp", "Name", "Value"]
 
+HEADER_LIST = ["Timestamp", "Name", "Value", "Data"]
 
-def filter_dataframe(dataframe: pd.DataFrame, name_filter: str):
-    return dataframe.loc[dataframe[HEADER_LIST[1]] == name_filter]
+
+def _hash_log_buffer(buffer):
+    return hashlib.blake2b(buffer, digest_size=16).digest()
+
+
+# Hash uploaded logs by content, without pickling them
+LOG_HASH_FUNCS = {
+    bytes: _hash_log_buffer,
+    memoryview: _hash_log_buffer,
+}
+
+
+# Results derived from the parsed log dataframe are keyed by the digest of the
+# log it came from, which read_log_to_dataframe returns alongside it. The
+# dataframe itself is passed as an underscore-prefixed argument, which Streamlit
+# does not hash
+@st.cache_data(max_entries=16)
+def filter_dataframe(log_digest: bytes, _dataframe: pd.DataFrame, name_filter: str):
+    return _dataframe.loc[_dataframe[HEADER_LIST[1]] == name_filter]
+
+
+@st.cache_data(max_entries=4)
+def get_log_keys(log_digest: bytes, _dataframe: pd.DataFrame):
+    return list(_dataframe[HEADER_LIST[1]].cat.categories)
 
 
 def exclude_from_dataframe(dataframe: pd.DataFrame, name_to_exclude: str):
     return dataframe.loc[dataframe[HEADER_LIST[1]] != name_to_exclude]
 
 
+def open_log_buffer(log_file):
+    # Uploaded files are held in memory, share their bytes without copying them
+    return log_file.getbuffer()
+
+
+@st.cache_resource(show_spinner=True, max_entries=4, hash_funcs=LOG_HASH_FUNCS)
 def read_log_to_dataframe(input_file_bytes: bytes):
+    log_digest = _hash_log_buffer(input_file_bytes)
+
     [output, error] = convert_data_log_to_list(input_file_bytes=input_file_bytes)
 
-    # Convert the log data to a pandas dataframe
-    log_as_dataframe = pd.DataFrame(output)
+    # Entries with numeric values fill the float64 Value column, everything else
+    # (strings, arrays, formatted times) goes in the object Data column. Integer
+    # and boolean values are also kept exactly in Data, since float64 cannot hold
+    # every int64
+    blocks = [
+        [name_code, block]
+        for name_code, name_blocks in enumerate(output.values())
+        for block in name_blocks
+    ]
+    lengths = [len(block[0]) for name_code, block in blocks]
+    row_count = sum(lengths)
+
+    timestamp_column = np.empty(row_count, dtype=np.float64)
+    value_column = np.full(row_count, np.nan)
+    data_column = np.full(row_count, None, dtype=object)
+    source_rows = np.empty(row_count, dtype=np.int64)
+
+    start = 0
+    for [name_code, [timestamps, values, rows]], length in zip(blocks, lengths):
+        timestamp_column[start : start + length] = timestamps
+        source_rows[start : start + length] = rows
+        if isinstance(values, np.ndarray):
+            value_column[start : start + length] = values
+            if values.dtype != np.float64:
+                data_column[start : start + length] = values
+        else:
+            data_column[start : start + length] = pd.Series(values, dtype=object)
+        start += length
+
+    name_codes = np.repeat(
+        np.array([name_code for name_code, block in blocks], dtype=np.int64), lengths
+    )
+
+    # The columns were filled one block at a time, put the rows back in log order
+    log_order = np.argsort(source_rows, kind="stable")
+
+    name_codes = name_codes[log_order]
+
+    # Names were added as their spans closed, list them in the order they first
+    # appear in the log instead
+    names = list(output)
+    first_seen = pd.unique(name_codes)
+    name_ranks = np.empty(len(names), dtype=np.int64)
+    name_ranks[first_seen] = np.arange(len(first_seen))
+
+    name_column = pd.Categorical.from_codes(
+        name_ranks[name_codes], categories=[names[code] for code in first_seen]
+    )
 
-    log_as_dataframe.columns = HEADER_LIST
+    # Convert the log data to a pandas dataframe
+    log_as_dataframe = pd.DataFrame(
+        {
+            HEADER_LIST[0]: timestamp_column[log_order],
+            HEADER_LIST[1]: name_column,
+            HEADER_LIST[2]: value_column[log_order],
+            HEADER_LIST[3]: data_column[log_order],
+        }
+    )
 
-    return log_as_dataframe
+    return [log_digest, log_as_dataframe]
 
 
 def convert_data_log_to_list(input_file_bytes: bytes):
-    output = []
+    # Blocks of timestamps, values and record table rows for each entry name, as
+    # numpy arrays where possible. A name has one block per kind of value
+    output = {}
 
     error = None
 
     error_message = "Invalid file, verify that the file is a wpilog or try downloading the log file again."
 
-    reader = DataLogReader(input_file_bytes)
+    log_data = memoryview(input_file_bytes)
+    reader = DataLogReader(log_data)
+    log_bytes = np.frombuffer(log_data, dtype=np.uint8)
+
+    # Parse all of the record headers at once
+    [entry_ids, timestamps, data_offsets, data_sizes] = reader.decodeTable()
 
     entries = {}
 
-    for record in reader:
+    # Rows during which each entry was active, as [entry, first row, end row]
+    entry_spans = []
+
+    # Only control records are wrapped in a DataLogRecord, there is one per entry
+    # rather than one per data point
+    for row, record in reader.iterControl():
+        control_type = record.controlType
+
         # Store all record starting data in the entries dictionary
-        if record.isStart():
+        if control_type == kControlStart:
             try:
                 data = record.getStartData()
-                entries[data.entry] = data
+                data.decoder = get_entry_decoder(data)
+                if data.entry in entries:
+                    entry_spans.append([*entries[data.entry], row])
+                entries[data.entry] = [data, row]
             except TypeError as e:
                 error = error_message
 
         # Delete the finish entry of the current record
-        elif record.isFinish():
+        elif control_type == kControlFinish:
             try:
                 entry = record.getFinishEntry()
                 if entry in entries:
-                    del entries[entry]
+                    entry_spans.append([*entries.pop(entry), row])
             except TypeError as e:
                 error = error_message
 
         # Verify any available metadata
-        elif record.isSetMetadata():
+        elif control_type == kControlSetMetadata:
             try:
                 data = record.getSetMetadataData()
             except TypeError as e:
                 error = error_message
 
         # Verify that the type of the record is recognized
-        elif record.isControl():
+        else:
             error = error_message
 
-        # Extract and store the information from the current record
+    for data, first_row in entries.values():
+        entry_spans.append([data, first_row, len(entry_ids)])
+
+    # Group the rows by entry ID, keeping each group in log order
+    rows_by_entry = np.argsort(entry_ids, kind="stable")
+    sorted_entry_ids = entry_ids[rows_by_entry]
+
+    # Each entry's rows and decoded values, as [entry, rows, values]
+    decoded_spans = []
+
+    # Spans of fixed-width numeric entries, grouped by payload type
+    bulk_spans = {}
+
+    # Extract the information from each entry's records
+    for entry, first_row, end_row in entry_spans:
+        [start, stop] = np.searchsorted(
+            sorted_entry_ids, [entry.entry, entry.entry + 1]
+        )
+        entry_rows = rows_by_entry[start:stop]
+        [start, stop] = np.searchsorted(entry_rows, [first_row, end_row])
+        entry_rows = entry_rows[start:stop]
+
+        if len(entry_rows) == 0:
+            continue
+
+        decoded_span = [entry, entry_rows, None]
+        decoded_spans.append(decoded_span)
+
+        dtype = _BULK_DTYPES.get(entry.decoder)
+
+        # Fixed-width numeric payloads are decoded together below
+        if dtype is not None and np.all(data_sizes[entry_rows] == dtype.itemsize):
+            bulk_spans.setdefault(dtype, []).append(decoded_span)
         else:
-            entry = entries.get(record.entry, None)
+            payloads = [
+                log_data[offset : offset + size]
+                for offset, size in zip(
+                    data_offsets[entry_rows].tolist(), data_sizes[entry_rows].tolist()
+                )
+            ]
+            decoded_span[2] = list(map(entry.decoder, payloads))
+
+    # Gather the payloads of every entry of a type into one typed array, then
+    # split it back into the entries
+    for dtype, spans in bulk_spans.items():
+        rows = np.concatenate([entry_rows for entry, entry_rows, values in spans])
+        payload_bytes = gather_payloads(log_bytes, data_offsets[rows], dtype.itemsize)
+        if dtype == np.bool_:
+            values = payload_bytes != 0
+        else:
+            values = payload_bytes.view(dtype)
 
-            if entry is None:
-                continue
+        split_points = np.cumsum([len(span[1]) for span in spans])[:-1]
+        for span, span_values in zip(spans, np.split(values, split_points)):
+            span[2] = span_values
 
-            output.append(extract_value_from_entry(entry, record))
+    # Store the information from each entry, in the order the spans were found
+    for entry, entry_rows, values in decoded_spans:
+        add_entry_values(
+            output, entry.name, timestamps[entry_rows] / 1000000, values, entry_rows
+        )
 
     return [output, error]
 
 
-def extract_value_from_entry(entry, record):
-    timestamp = record.timestamp / 1000000
+def add_entry_values(output, name, timestamps, values, rows):
+    # Entry names may be restarted later in the log, possibly with another type.
+    # Merge with an earlier block of the same kind of values, so typed arrays are
+    # never converted to another dtype or to a list
+    blocks = output.setdefault(name, [])
+    for block in blocks:
+        [earlier_timestamps, earlier_values, earlier_rows] = block
+        if isinstance(earlier_values, np.ndarray) and isinstance(values, np.ndarray):
+            if earlier_values.dtype != values.dtype:
+                continue
+            merged_values = np.concatenate([earlier_values, values])
+        elif isinstance(earlier_values, list) and isinstance(values, list):
+            merged_values = earlier_values + values
+        else:
+            continue
+
+        timestamps = np.concatenate([earlier_timestamps, timestamps])
+        rows = np.concatenate([earlier_rows, rows])
+        values = merged_values
+
+        # Spans are added in the order they were closed, which is not always the
+        # order their records appear in the log
+        if not np.all(rows[1:] > rows[:-1]):
+            order = np.argsort(rows, kind="stable")
+            timestamps = timestamps[order]
+            rows = rows[order]
+            if isinstance(values, np.ndarray):
+                values = values[order]
+            else:
+                values = [values[i] for i in order]
+
+        block[:] = [timestamps, values, rows]
+        return
+
+    blocks.append([timestamps, values, rows])
+
+
+def _decode_double(data):
+    return doubleStruct.unpack(data)[0]
+
+
+def _decode_int64(data):
+    return int64Struct.unpack(data)[0]
+
+
+def _decode_string(data):
+    return str(data, encoding="utf-8")
+
+
+def _decode_boolean(data):
+    return data[0] != 0
+
+
+# Array decoders return read-only views into the log buffer rather than copies;
+# call .copy() on a value before modifying it
+def _decode_boolean_array(data):
+    return np.frombuffer(data, dtype=np.uint8) != 0
+
+
+def _decode_double_array(data):
+    return np.frombuffer(data, dtype="<f8")
+
 
-    value = None
+def _decode_float_array(data):
+    return np.frombuffer(data, dtype="<f4")
 
+
+def _decode_int64_array(data):
+    return np.frombuffer(data, dtype="<i8")
+
+
+def _decode_string_array(data):
+    return decodeStringArray(data)
+
+
+def _decode_system_time(data):
+    dt = datetime.fromtimestamp(_decode_int64(data) / 1000000)
+    return "{:%Y-%m-%d %H:%M:%S.%f}".format(dt)
+
+
+def _decode_unknown(data):
+    return None
+
+
+# Payloads for these decoders can be read directly as numpy arrays
+_BULK_DTYPES = {
+    _decode_double: np.dtype("<f8"),
+    _decode_int64: np.dtype("<i8"),
+    _decode_boolean: np.dtype(np.bool_),
+}
+
+_DECODERS = {
+    "double": _decode_double,
+    "int64": _decode_int64,
+    "string": _decode_string,
+    "json": _decode_string,
+    "boolean": _decode_boolean,
+    "boolean[]": _decode_boolean_array,
+    "double[]": _decode_double_array,
+    "float[]": _decode_float_array,
+    "int64[]": _decode_int64_array,
+    "string[]": _decode_string_array,
+}
+
+
+def get_entry_decoder(entry):
     # Handle the system time-type entries
     if entry.name == "systemTime" and entry.type == "int64":
-        dt = datetime.fromtimestamp(record.getInteger() / 1000000)
-        value = "{:%Y-%m-%d %H:%M:%S.%f}".format(dt)
-    else:
-        match entry.type:
-            case "double":
-                value = record.getDouble()
-            case "int64":
-                value = record.getInteger()
-            case "string" | "json":
-                value = record.getString()
-            case "boolean":
-                value = record.getBoolean()
-            case "boolean[]":
-                value = list(record.getBooleanArray())
-            case "double[]":
-                value = list(record.getDoubleArray())
-            case "float[]":
-                value = list(record.getFloatArray())
-            case "int64[]":
-                value = list(record.getIntegerArray())
-            case "string[]":
-                value = list(record.getStringArray())
-
-    return [timestamp, entry.name, value]
+        return _decode_system_time
 
+    return _DECODERS.get(entry.type, _decode_unknown)
 
-def plot_dataframe(dataframe: pd.DataFrame):
-    # Include only timestamps and values
-    key_only_df = dataframe[[HEADER_LIST[0], HEADER_LIST[2]]]
 
-    st.line_chart(key_only_df, x="Timestamp", y="Value")
+def plot_values(timestamps: np.ndarray, values: np.ndarray, label: str = "Value"):
+    # Streamlit accepts the arrays directly, no intermediate dataframe is needed
+    st.line_chart(
+        {HEADER_LIST[0]: timestamps, label: values}, x=HEADER_LIST[0], y=label
+    )
+
 
+def plot_dataframe(dataframe: pd.DataFrame):
+    # Include only timestamps and values
+    plot_values(
+        dataframe[HEADER_LIST[0]].to_numpy(), dataframe[HEADER_LIST[2]].to_numpy()
+    )
+
+
+@st.cache_data(max_entries=4)
+def convert_df_to_csv(log_digest: bytes, _dataframe: pd.DataFrame):
+    # Write array values as lists, numpy would print long arrays abbreviated
+    dataframe = _dataframe.assign(
+        **{
+            HEADER_LIST[3]: _dataframe[HEADER_LIST[3]].map(
+                lambda value: value.tolist() if isinstance(value, np.ndarray) else value
+            )
+        }
+    )
 
-@st.cache
-def convert_df_to_csv(dataframe: pd.DataFrame):
     # Cache the conversion to prevent computation on every rerun
     return dataframe.to_csv().encode("utf-8")
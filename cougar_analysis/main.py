@@ -14,14 +14,14 @@ log_file = st.file_uploader("Select a log file for analysis", type=["wpilog"])
 
 if log_file is not None:
     # Convert the log file to a dataframe
-    log_as_bytes = log_file.getvalue()
-    log_as_dataframe = read_log_to_dataframe(log_as_bytes)
+    log_buffer = open_log_buffer(log_file)
+    [log_digest, log_as_dataframe] = read_log_to_dataframe(log_buffer)
 
     # Provide the option to download the file as a csv
     with st.expander("Download as CSV"):
         filename = st.text_input("Input the desired file name (no extension)")
 
-        converted_csv = convert_df_to_csv(log_as_dataframe)
+        converted_csv = convert_df_to_csv(log_digest, log_as_dataframe)
 
         st.download_button(
             label="Download converted file",
@@ -31,10 +31,10 @@ if log_file is not None:
         )
 
     # Allow the user to select one key at a time
-    all_keys = log_as_dataframe["Name"].unique()
+    all_keys = get_log_keys(log_digest, log_as_dataframe)
     selected_key = st.selectbox("Select a numerical key to analyze", all_keys)
 
-    key_only_df = filter_dataframe(log_as_dataframe, selected_key)
+    key_only_df = filter_dataframe(log_digest, log_as_dataframe, selected_key)
     ranged_df = key_only_df
 
     # Plot the selected key in the log
@@ -43,62 +43,60 @@ if log_file is not None:
     st.subheader("Select a Range for Futher Analysis")
 
     timestamps = key_only_df["Timestamp"]
+    first_timestamp, last_timestamp = float(timestamps.min()), float(timestamps.max())
 
-    range_start = st.select_slider(
-        "Range Start", options=timestamps, value=timestamps.min()
-    )
-    range_end = st.select_slider(
-        "Range End", options=timestamps, value=timestamps.max()
-    )
-
-    ranged_df = key_only_df.loc[
-        key_only_df["Timestamp"].between(
-            float(range_start), float(range_end), inclusive="both"
+    # Numeric sliders only send their bounds to the browser, not every timestamp.
+    # They need distinct bounds, so a key logged at a single time has no range
+    if first_timestamp < last_timestamp:
+        range_start = st.slider(
+            "Range Start", first_timestamp, last_timestamp, first_timestamp
+        )
+        range_end = st.slider(
+            "Range End", first_timestamp, last_timestamp, last_timestamp
         )
-    ]
+    else:
+        range_start, range_end = first_timestamp, last_timestamp
+
+    # Samples of one key are normally logged in time order, so the range can be
+    # found with a binary search. The log format does not guarantee it, so fall
+    # back to comparing every timestamp when they are out of order
+    if timestamps.is_monotonic_increasing:
+        timestamp_values = timestamps.to_numpy()
+        range_start_index = np.searchsorted(timestamp_values, range_start, side="left")
+        range_end_index = np.searchsorted(timestamp_values, range_end, side="right")
+
+        ranged_df = key_only_df.iloc[range_start_index:range_end_index]
+    else:
+        ranged_df = key_only_df.loc[
+            timestamps.between(range_start, range_end, inclusive="both")
+        ]
+
+    # The sliders do not snap to samples, so the range can fall between two of them
+    if len(ranged_df) == 0:
+        st.write("No samples in the selected range")
+        st.stop()
 
     # Plot the selected range
     plot_dataframe(ranged_df)
 
+    times = ranged_df["Timestamp"].to_numpy()
+    values = ranged_df["Value"].to_numpy(dtype=float)
+
     # Calculate 5 number summary
-    [q1, med, q3] = np.percentile(ranged_df["Value"], [25, 50, 75])
-    minimum, maximum = ranged_df["Value"].min(), ranged_df["Value"].max()
-    mean = ranged_df["Value"].mean()
+    [minimum, q1, med, q3, maximum] = np.quantile(values, [0, 0.25, 0.5, 0.75, 1])
+    mean = values.mean()
 
     st.subheader("5 Number Summary")
     st.write(f"Min: {minimum} | Q1: {q1} | Med: {med} | Q3: {q3} | Max: {maximum}")
     st.write(f"Mean: {mean}")
 
-    # Calculate the 1st derivative
-    derivative_series = ranged_df["Value"].diff() / ranged_df["Timestamp"].diff()
-    derivative_series.name = "1st Derivative"
-
-    # Construct a derivative dataframe
-    derivative_df = pd.concat(
-        [
-            ranged_df["Timestamp"],
-            derivative_series,
-        ],
-        axis=1,
-    )
+    # Calculate the 1st and 2nd derivatives
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derivative = np.diff(values) / np.diff(times)
+        derivative2 = np.diff(derivative) / np.diff(times[1:])
 
     st.subheader("Graph of 1st Derivative")
-    st.line_chart(derivative_df, x="Timestamp", y="1st Derivative")
-
-    # Calculate the 2nd derivative
-    derivative2_series = (
-        derivative_df["1st Derivative"].diff() / derivative_df["Timestamp"].diff()
-    )
-    derivative2_series.name = "2nd Derivative"
-
-    # Construct a derivative dataframe
-    derivative2_df = pd.concat(
-        [
-            ranged_df["Timestamp"],
-            derivative2_series,
-        ],
-        axis=1,
-    )
+    plot_values(times[1:], derivative, "1st Derivative")
 
     st.subheader("Graph of 2nd Derivative")
-    st.line_chart(derivative2_df, x="Timestamp", y="2nd Derivative")
+    plot_values(times[2:], derivative2, "2nd Derivative")
@@ -0,0 +1,218 @@
+import importlib.util
+import struct
+import unittest
+
+import numpy as np
+
+from cougar_analysis import _python_decode
+from cougar_analysis.data_log_reader import DataLogIterator, DataLogReader
+from cougar_analysis.log_helpers import convert_data_log_to_list, read_log_to_dataframe
+
+
+def _varint(value):
+    # Smallest little-endian encoding of value, at least one byte
+    width = max(1, (value.bit_length() + 7) // 8)
+    return value.to_bytes(width, "little"), width - 1
+
+
+def _record(entry, timestamp, payload):
+    entry_bytes, entry_len = _varint(entry)
+    size_bytes, size_len = _varint(len(payload))
+    timestamp_bytes, timestamp_len = _varint(timestamp)
+    header = entry_len | (size_len << 2) | (timestamp_len << 4)
+    return bytes([header]) + entry_bytes + size_bytes + timestamp_bytes + payload
+
+
+def _string(value):
+    encoded = value.encode("utf-8")
+    return struct.pack("<I", len(encoded)) + encoded
+
+
+def _start(entry, name, type, timestamp):
+    payload = b"\x00" + struct.pack("<I", entry) + _string(name) + _string(type)
+    return _record(0, timestamp, payload + _string(""))
+
+
+def _finish(entry, timestamp):
+    return _record(0, timestamp, b"\x01" + struct.pack("<I", entry))
+
+
+def _set_metadata(entry, metadata, timestamp):
+    return _record(0, timestamp, b"\x02" + struct.pack("<I", entry) + _string(metadata))
+
+
+def _string_array(values):
+    return struct.pack("<I", len(values)) + b"".join(map(_string, values))
+
+
+def build_log():
+    records = [
+        _start(1, "/double", "double", 1000),
+        _start(2, "/int", "int64", 1000),
+        _start(3, "/bool", "boolean", 1000),
+        _start(4, "/strings", "string[]", 1000),
+        _start(5, "/doubles", "double[]", 1000),
+        _start(6, "/shared", "double", 1000),
+        _start(7, "/shared", "double", 1000),
+        _start(10, "/mixed", "int64", 1000),
+        _set_metadata(1, "units=m", 1500),
+        # Data for an entry that was never started is ignored
+        _record(40, 1600, struct.pack("<d", 9.0)),
+    ]
+
+    timestamp = 2000
+    for i in range(40):
+        # Timestamps and payload sizes grow to need wider header fields
+        timestamp += 1 << i
+        records.append(_record(1, timestamp, struct.pack("<d", i * 0.5)))
+        records.append(_record(2, timestamp, struct.pack("<q", (1 << 62) + i)))
+        records.append(_record(3, timestamp, bytes([i % 3 == 0])))
+        records.append(_record(4, timestamp, _string_array(["a" * i, "b"])))
+        records.append(_record(5, timestamp, struct.pack("<3d", i, -i, 0.25)))
+        records.append(_record(6 + i % 2, timestamp, struct.pack("<d", -i)))
+        records.append(_record(10, timestamp, struct.pack("<q", (1 << 60) + i)))
+
+        if i == 10:
+            # Data after a finish record is ignored
+            records.append(_finish(1, timestamp))
+        elif i == 15:
+            # Restarting an ID without finishing it replaces the old entry
+            records.append(_start(2, "/restarted", "string", timestamp))
+        elif i == 20:
+            # A name can be started again under another ID
+            records.append(_start(8, "/double", "double", timestamp))
+        elif i == 25:
+            # The second /shared span closes before the first
+            records.append(_finish(7, timestamp))
+
+        if i == 12:
+            # A name can be restarted with another type, the same int64 payloads
+            # are then read as doubles and later as strings
+            records.append(_finish(10, timestamp))
+            records.append(_start(10, "/mixed", "double", timestamp))
+        elif i == 30:
+            records.append(_start(10, "/mixed", "string", timestamp))
+
+        records.append(_record(8, timestamp, struct.pack("<d", i)))
+        records.append(_record(9, timestamp, b"x" * (300 * i)))
+
+    extra_header = b"test"
+    header = b"WPILOG" + struct.pack("<HI", 0x0100, len(extra_header))
+    return header + extra_header + b"".join(records)
+
+
+def decode_records(log):
+    # Decodes the log one record at a time, as the original WPILib reader does
+    output = {}
+    entries = {}
+    for record in DataLogReader(log):
+        if record.isStart():
+            data = record.getStartData()
+            entries[data.entry] = data
+        elif record.isFinish():
+            entries.pop(record.getFinishEntry(), None)
+        elif not record.isControl() and record.entry in entries:
+            entry = entries[record.entry]
+            value = {
+                "double": record.getDouble,
+                "int64": record.getInteger,
+                "boolean": record.getBoolean,
+                "string": record.getString,
+                "string[]": record.getStringArray,
+                "double[]": lambda: record.getDoubleArray().tolist(),
+            }[entry.type]()
+            output.setdefault(entry.name, []).append(
+                (record.timestamp / 1000000, value)
+            )
+    return output
+
+
+class ScanRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.log = build_log()
+        self.start = DataLogReader(self.log)._getRecordsStart()
+
+    def assertMatchesIterator(self, scan_records):
+        buf = np.frombuffer(self.log, dtype=np.uint8)
+        entries, timestamps, offsets, sizes = scan_records(buf, self.start)
+
+        records = list(DataLogIterator(self.log, self.start))
+        self.assertEqual(entries.tolist(), [record.entry for record in records])
+        self.assertEqual(timestamps.tolist(), [record.timestamp for record in records])
+        self.assertEqual(
+            [self.log[offset : offset + size] for offset, size in zip(offsets, sizes)],
+            [bytes(record.data) for record in records],
+        )
+
+    def test_python_scan_matches_iterator(self):
+        self.assertMatchesIterator(_python_decode.scan_records)
+
+    @unittest.skipUnless(importlib.util.find_spec("numba"), "numba is not installed")
+    def test_numba_scan_matches_iterator(self):
+        from cougar_analysis import _numba_decode
+
+        self.assertMatchesIterator(_numba_decode.scan_records)
+
+
+class ConvertDataLogTest(unittest.TestCase):
+    def test_matches_per_record_decode(self):
+        log = build_log()
+        [output, error] = convert_data_log_to_list(log)
+
+        self.assertIsNone(error)
+        expected = decode_records(log)
+        self.assertEqual(sorted(output), sorted(expected))
+        for name, blocks in output.items():
+            samples = []
+            for timestamps, values, rows in blocks:
+                self.assertTrue(np.all(np.diff(rows) > 0), name)
+                if isinstance(values, np.ndarray):
+                    values = values.tolist()
+                values = [
+                    value.tolist() if isinstance(value, np.ndarray) else value
+                    for value in values
+                ]
+                samples.extend(zip(rows.tolist(), timestamps.tolist(), values))
+            samples.sort()
+            self.assertEqual(
+                [(timestamp, value) for row, timestamp, value in samples],
+                expected[name],
+            )
+
+    def test_restarted_and_reused_spans(self):
+        [output, error] = convert_data_log_to_list(build_log())
+
+        def block_lengths(name):
+            return [len(values) for timestamps, values, rows in output[name]]
+
+        self.assertEqual(block_lengths("/double"), [11 + 20])
+        self.assertEqual(block_lengths("/int"), [16])
+        self.assertEqual(block_lengths("/restarted"), [24])
+        self.assertEqual(block_lengths("/shared"), [20 + 13])
+
+        # Each type a name was started with keeps its own block
+        self.assertEqual(block_lengths("/mixed"), [13, 18, 9])
+        self.assertEqual(output["/mixed"][0][1].dtype, np.int64)
+        self.assertEqual(output["/mixed"][0][1][-1], (1 << 60) + 12)
+
+
+class ReadLogToDataframeTest(unittest.TestCase):
+    def test_restarted_types_keep_numeric_values(self):
+        [log_digest, dataframe] = read_log_to_dataframe(build_log())
+
+        self.assertTrue(dataframe["Timestamp"].is_monotonic_increasing)
+        mixed = dataframe[dataframe["Name"] == "/mixed"]
+        self.assertEqual(mixed["Value"].notna().tolist(), [True] * 31 + [False] * 9)
+        self.assertEqual(mixed["Data"].iloc[12], (1 << 60) + 12)
+
+    def test_names_in_log_order(self):
+        log = build_log()
+        [log_digest, dataframe] = read_log_to_dataframe(log)
+
+        self.assertEqual(
+            list(dataframe["Name"].cat.categories), list(decode_records(log))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()